@@ -74,6 +74,11 @@ rl_arg.add_argument('--compute_cost_method', type=str, default='reachability', h
 train_arg = parser.add_argument_group('train')
 train_arg.add_argument('--use_cuda', type=int, default=1, help='Whether to use GPU')
 train_arg.add_argument('--num_train_epochs', type=int, default=100, help='Number of training epochs')
+train_arg.add_argument('--use_compile', type=str2bool, default=False, help='Whether to compile the policy with torch.compile (requires torch>=2.2)')
+train_arg.add_argument('--allow_tf32', type=str2bool, default=False, help='Whether to allow TF32 matmuls on GPU')
+train_arg.add_argument('--use_amp', type=str2bool, default=False, help='Whether to run the policy forward passes in bf16 autocast on GPU')
+train_arg.add_argument('--use_inference_server', type=str2bool, default=False, help='Whether to sample the k paths of the sampling search in threads whose policy forward passes are batched by an inference server')
+train_arg.add_argument('--inference_max_batch_size', type=int, default=32, help='Maximum number of observations per forward pass of the inference server')
 train_arg.add_argument('--distributed_training', type=str2bool, default=True, help='Number of training epochs')
 train_arg.add_argument('--num_workers', type=int, default=1, help='Number of workers to distributedly train')
 train_arg.add_argument('--num_meta_learning_epochs', type=int, default=50, help='Number of meta learning epochs')
@@ -87,6 +92,8 @@ train_arg.add_argument('--coef_contrastive_loss', type=float, default=0., help='
 
 # train_arg.add_argument('--num_workers', type=int, default=10, help='Number of sub workers who collect experience asynchronously')
 train_arg.add_argument('--batch_size', type=int, default=128, help='Batch size of training')
+train_arg.add_argument('--grad_accumulation_steps', type=int, default=1, help='Number of minibatches whose gradients are accumulated per optimizer step')
+train_arg.add_argument('--enable_parallel_tasks', type=str2bool, default=False, help='Whether to run the updates of the task policies on concurrent CUDA streams (multi-policy solvers)')
 train_arg.add_argument('--target_steps', type=int, default=1024, help='Number of steps to collect before update')
 train_arg.add_argument('--repeat_times', type=int, default=10, help='')
 train_arg.add_argument('--gae_lambda', type=float, default=0.98, help='')
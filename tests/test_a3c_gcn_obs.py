@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+pytest.importorskip('gym')
+
+from torch_geometric.data import Batch
+from virne.solver.learning.utils import get_pyg_data
+from virne.solver.learning.rl_base.buffer import RolloutBuffer
+from virne.solver.learning.a3c_gcn.solver import OBS_ARRAY_FIELDS, obs_as_tensor
+
+
+NUM_P_NODES = 5
+P_NET_EDGE_INDEX = np.array([[0, 1, 1, 2, 3, 4], [1, 0, 2, 1, 4, 3]])
+OTHER_P_NET_EDGE_INDEX = np.array([[0, 2, 2, 4], [2, 0, 4, 2]])
+
+
+def make_obs(i, p_net_edge_index=P_NET_EDGE_INDEX):
+    rng = np.random.default_rng(i)
+    return {
+        'p_net_x': rng.random((NUM_P_NODES, 3), dtype=np.float32),
+        'p_net_edge_index': p_net_edge_index,
+        'v_net_x': rng.random(4, dtype=np.float32),
+        'curr_v_node_id': i % 3,
+        'v_net_size': float(i + 2),
+        'action_mask': (rng.random(NUM_P_NODES) > 0.3).astype(np.float32),
+    }
+
+
+def reference_p_net(observations):
+    return Batch.from_data_list([get_pyg_data(obs['p_net_x'], obs['p_net_edge_index']) for obs in observations])
+
+
+def assert_p_net_equal(p_net, reference):
+    for key in ['x', 'edge_index', 'batch', 'ptr']:
+        torch.testing.assert_close(getattr(p_net, key), getattr(reference, key))
+
+
+def as_observation_batch(observations):
+    buffer = RolloutBuffer(OBS_ARRAY_FIELDS)
+    for obs in observations:
+        buffer.add(obs, action=0, raward=0., done=False, logprob=0., value=0.)
+    return buffer.get_observations(list(range(len(observations))))
+
+
+def make_observations(topologies):
+    return [make_obs(i, p_net_edge_index) for i, p_net_edge_index in enumerate(topologies)]
+
+
+@pytest.mark.parametrize('topologies', [
+    pytest.param([P_NET_EDGE_INDEX] * 4, id='shared_topology'),
+    pytest.param([P_NET_EDGE_INDEX, OTHER_P_NET_EDGE_INDEX, P_NET_EDGE_INDEX], id='mixed_topologies'),
+])
+@pytest.mark.parametrize('as_batch', [False, True], ids=['list', 'observation_batch'])
+def test_batched_p_net_matches_from_data_list(topologies, as_batch):
+    observations = make_observations(topologies)
+    obs = as_observation_batch(observations) if as_batch else observations
+    tensor_obs = obs_as_tensor(obs, 'cpu')
+    assert_p_net_equal(tensor_obs['p_net'], reference_p_net(observations))
+    torch.testing.assert_close(tensor_obs['v_net_x'], torch.tensor(np.array([o['v_net_x'] for o in observations])))
+    torch.testing.assert_close(tensor_obs['curr_v_node_id'], torch.tensor([o['curr_v_node_id'] for o in observations]))
+    torch.testing.assert_close(tensor_obs['v_net_size'], torch.tensor([o['v_net_size'] for o in observations], dtype=torch.float32))
+    torch.testing.assert_close(tensor_obs['action_mask'], torch.tensor(np.array([o['action_mask'] for o in observations])))
+
+
+def test_batched_p_net_after_topology_change():
+    # the cached edges of the first topology must not be reused for another one of the same batch size
+    for topology in [P_NET_EDGE_INDEX, OTHER_P_NET_EDGE_INDEX]:
+        observations = make_observations([topology] * 3)
+        assert_p_net_equal(obs_as_tensor(observations, 'cpu')['p_net'], reference_p_net(observations))
+
+
+@pytest.mark.parametrize('p_net_edge_index', [P_NET_EDGE_INDEX, OTHER_P_NET_EDGE_INDEX], ids=['topology', 'other_topology'])
+def test_single_p_net_matches_from_data_list(p_net_edge_index):
+    obs = make_obs(0, p_net_edge_index)
+    tensor_obs = obs_as_tensor(obs, 'cpu')
+    assert_p_net_equal(tensor_obs['p_net'], reference_p_net([obs]))
+    assert tensor_obs['p_net'].num_graphs == 1
+    torch.testing.assert_close(tensor_obs['v_net_x'], torch.tensor(obs['v_net_x']).unsqueeze(0))
+    torch.testing.assert_close(tensor_obs['curr_v_node_id'], torch.tensor([obs['curr_v_node_id']]))
+    torch.testing.assert_close(tensor_obs['v_net_size'], torch.tensor([obs['v_net_size']], dtype=torch.float32))
+    torch.testing.assert_close(tensor_obs['action_mask'], torch.tensor(obs['action_mask']).unsqueeze(0))
@@ -0,0 +1,73 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+pytest.importorskip('gym')
+
+from torch.distributions import Categorical
+from virne.solver.learning.utils import apply_mask_to_logit, sample_action_from_logits
+
+
+SOFTMAX_TEMP = 1.5
+NUM_ACTIONS = 6
+
+
+def make_logits_and_mask(batch_shape):
+    torch.manual_seed(0)
+    logits = torch.randn(*batch_shape, NUM_ACTIONS)
+    mask = torch.rand(*batch_shape, NUM_ACTIONS) > 0.4
+    # at least one candidate action per row
+    mask[..., 0] = True
+    return logits, mask
+
+
+def reference_dists(logits, mask, masked_logprob):
+    """The Categorical distributions of the former implementation: one to select actions, one to score them."""
+    candidate_dist = Categorical(logits=apply_mask_to_logit(logits, mask) / SOFTMAX_TEMP)
+    raw_dist = Categorical(logits=logits / SOFTMAX_TEMP)
+    return candidate_dist, candidate_dist if masked_logprob else raw_dist
+
+
+CASES = [
+    pytest.param(False, True, id='no_mask'),
+    pytest.param(True, True, id='mask_masked_logprob'),
+    pytest.param(True, False, id='mask_raw_logprob'),
+]
+
+
+@pytest.mark.parametrize('batch_shape', [(), (4,)], ids=['1d', 'batched'])
+@pytest.mark.parametrize('use_mask, masked_logprob', CASES)
+def test_greedy_action(batch_shape, use_mask, masked_logprob):
+    logits, mask = make_logits_and_mask(batch_shape)
+    mask = mask if use_mask else None
+    action, action_logprob = sample_action_from_logits(logits, mask, sample=False, softmax_temp=SOFTMAX_TEMP, masked_logprob=masked_logprob)
+    candidate_dist, logprob_dist = reference_dists(logits, mask, masked_logprob)
+    assert action.shape == batch_shape
+    torch.testing.assert_close(action, candidate_dist.logits.argmax(-1))
+    torch.testing.assert_close(action_logprob, logprob_dist.log_prob(action))
+
+
+@pytest.mark.parametrize('batch_shape', [(), (4,)], ids=['1d', 'batched'])
+@pytest.mark.parametrize('use_mask, masked_logprob', CASES)
+def test_sampled_action(batch_shape, use_mask, masked_logprob):
+    logits, mask = make_logits_and_mask(batch_shape)
+    candidate_dist, logprob_dist = reference_dists(logits, mask if use_mask else None, masked_logprob)
+    for _ in range(20):
+        action, action_logprob = sample_action_from_logits(logits, mask if use_mask else None, sample=True,
+                                                           softmax_temp=SOFTMAX_TEMP, masked_logprob=masked_logprob)
+        assert action.shape == batch_shape
+        if use_mask:
+            # actions are always sampled among the candidates
+            assert mask.gather(-1, action.unsqueeze(-1)).all()
+        torch.testing.assert_close(action_logprob, logprob_dist.log_prob(action))
+
+
+def test_sampling_follows_the_candidate_distribution():
+    logits, mask = make_logits_and_mask((2,))
+    candidate_dist, _ = reference_dists(logits, mask, True)
+    batch_logits, batch_mask = logits.repeat(5000, 1), mask.repeat(5000, 1)
+    action, _ = sample_action_from_logits(batch_logits, batch_mask, sample=True, softmax_temp=SOFTMAX_TEMP)
+    action = action.reshape(5000, 2)
+    for row in range(2):
+        frequencies = torch.bincount(action[:, row], minlength=NUM_ACTIONS).float() / 5000
+        torch.testing.assert_close(frequencies, candidate_dist.probs[row], atol=0.03, rtol=0.)
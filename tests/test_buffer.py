@@ -0,0 +1,75 @@
+import pytest
+import numpy as np
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+pytest.importorskip('gym')
+
+from virne.solver.learning.rl_base.buffer import RolloutBuffer, ObservationBatch
+
+
+OBS_ARRAY_FIELDS = {'x': np.float32, 'mask': np.int64}
+
+
+def make_obs(i):
+    return {'x': np.full((3, 2), i, dtype=np.float32), 'mask': np.array([i, i + 1]), 'edge_index': np.zeros((2, 0))}
+
+
+def make_buffer(num_steps, pin_memory=False):
+    buffer = RolloutBuffer(OBS_ARRAY_FIELDS, pin_memory=pin_memory)
+    for i in range(num_steps):
+        buffer.add(make_obs(i), action=i, raward=float(i), done=i == num_steps - 1, logprob=0., value=0.)
+    return buffer
+
+
+@pytest.mark.parametrize('pin_memory', [
+    False,
+    pytest.param(True, marks=pytest.mark.skipif(not torch.cuda.is_available(), reason='pinned memory requires CUDA')),
+])
+def test_get_observations(pin_memory):
+    buffer = make_buffer(5, pin_memory=pin_memory)
+    indices = [4, 0, 2]
+    batch = buffer.get_observations(indices)
+    assert isinstance(batch, ObservationBatch)
+    assert [obs['mask'][0] for obs in batch] == indices
+    x, mask = np.asarray(batch.arrays['x']), np.asarray(batch.arrays['mask'])
+    np.testing.assert_array_equal(x, np.stack([make_obs(i)['x'] for i in indices]))
+    np.testing.assert_array_equal(mask, np.stack([make_obs(i)['mask'] for i in indices]))
+    if pin_memory:
+        assert all(array.is_pinned() for array in batch.arrays.values())
+
+
+def test_get_observations_without_arrays():
+    buffer = RolloutBuffer()
+    buffer.add(make_obs(0), action=0, raward=0., done=True, logprob=0., value=0.)
+    batch = buffer.get_observations([0])
+    assert not isinstance(batch, ObservationBatch)
+    assert batch[0]['mask'][0] == 0
+
+
+def test_obs_arrays_grow_and_survive_reset():
+    buffer = make_buffer(5)
+    assert buffer.obs_arrays['x'].shape[0] >= 5
+    buffer.reset()
+    for i in range(3):
+        buffer.add(make_obs(10 + i), action=i, raward=0., done=False, logprob=0., value=0.)
+    np.testing.assert_array_equal(buffer.get_observations([1]).arrays['mask'], [[11, 12]])
+
+
+def test_get_subbuffer():
+    buffer = make_buffer(5)
+    indices = [3, 1]
+    sub_buffer = buffer.get_subbuffer(indices)
+    assert sub_buffer.actions == indices
+    assert sub_buffer.size() == len(indices)
+    for key in OBS_ARRAY_FIELDS:
+        np.testing.assert_array_equal(sub_buffer.obs_arrays[key], buffer.obs_arrays[key][indices])
+    np.testing.assert_array_equal(sub_buffer.get_observations([1]).arrays['x'], [make_obs(1)['x']])
+
+
+def test_merge_of_subbuffers():
+    buffer = make_buffer(4)
+    merged = buffer.get_subbuffer([2])
+    merged.merge(buffer.get_subbuffer([0, 3]))
+    assert merged.actions == [2, 0, 3]
+    np.testing.assert_array_equal(merged.get_observations([0, 1, 2]).arrays['mask'][:, 0], [2, 0, 3])
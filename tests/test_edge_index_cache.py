@@ -0,0 +1,53 @@
+import pytest
+import numpy as np
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+pytest.importorskip('gym')
+
+from virne.solver.learning.utils import StaticEdgeIndexCache, get_batched_edge_index
+
+
+NUM_NODES = 4
+EDGE_INDEX = np.array([[0, 1, 2], [1, 2, 3]])
+
+
+def test_batched_replica():
+    cache = StaticEdgeIndexCache()
+    edge_index = cache.get([EDGE_INDEX] * 3, NUM_NODES, 'cpu')
+    torch.testing.assert_close(edge_index, get_batched_edge_index([EDGE_INDEX] * 3, NUM_NODES))
+
+
+def test_reuses_replica_of_same_topology():
+    cache = StaticEdgeIndexCache()
+    first = cache.get([EDGE_INDEX] * 2, NUM_NODES, 'cpu')
+    # a copy of the same edges is recognized by its fingerprint
+    second = cache.get([EDGE_INDEX.copy(), EDGE_INDEX.copy()], NUM_NODES, 'cpu')
+    assert second is first
+
+
+def test_invalidates_on_new_topology_of_same_shape():
+    cache = StaticEdgeIndexCache()
+    cache.get([EDGE_INDEX] * 2, NUM_NODES, 'cpu')
+    other_edge_index = np.array([[0, 0, 0], [1, 2, 3]])
+    edge_index = cache.get([other_edge_index] * 2, NUM_NODES, 'cpu')
+    torch.testing.assert_close(edge_index, get_batched_edge_index([other_edge_index] * 2, NUM_NODES))
+    assert len(cache.device_edge_index) == 1
+
+
+def test_mixed_topologies_are_not_cached():
+    cache = StaticEdgeIndexCache()
+    other_edge_index = np.array([[0, 0, 0], [1, 2, 3]])
+    assert cache.get([EDGE_INDEX, other_edge_index], NUM_NODES, 'cpu') is None
+    assert len(cache.device_edge_index) == 0
+
+
+def test_evicts_least_recently_used_replica():
+    cache = StaticEdgeIndexCache(max_entries=2)
+    first = cache.get([EDGE_INDEX] * 1, NUM_NODES, 'cpu')
+    cache.get([EDGE_INDEX] * 2, NUM_NODES, 'cpu')
+    assert cache.get([EDGE_INDEX] * 1, NUM_NODES, 'cpu') is first
+    cache.get([EDGE_INDEX] * 3, NUM_NODES, 'cpu')
+    assert len(cache.device_edge_index) == 2
+    assert ('cpu', 2, NUM_NODES) not in cache.device_edge_index
+    assert cache.get([EDGE_INDEX] * 1, NUM_NODES, 'cpu') is first
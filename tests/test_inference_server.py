@@ -0,0 +1,94 @@
+import time
+import threading
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+pytest.importorskip('gym')
+
+from virne.solver.learning.rl_base.inference_server import BatchedInferenceServer, close_servers
+
+
+class RecordingPolicy:
+    """Return the observation ids as logits, recording the size of every forward pass."""
+    def __init__(self):
+        self.batch_sizes = []
+
+    def act(self, tensor_obs):
+        self.batch_sizes.append(len(tensor_obs))
+        return tensor_obs[:, None].repeat(1, 3)
+
+
+def preprocess_obs(observations, device=None):
+    return torch.tensor([obs['id'] for obs in observations], dtype=torch.float32, device=device)
+
+
+@pytest.fixture
+def server():
+    server = BatchedInferenceServer(RecordingPolicy(), preprocess_obs, 'cpu', max_batch_size=8, timeout=0.05)
+    yield server
+    server.close()
+
+
+def test_single_and_list_requests(server):
+    assert server.act({'id': 7}).tolist() == [[7., 7., 7.]]
+    assert server.act([{'id': 1}, {'id': 2}])[:, 0].tolist() == [1., 2.]
+
+
+def test_routes_results_of_concurrent_requests(server):
+    num_threads = 16
+    results = {}
+    barrier = threading.Barrier(num_threads)
+
+    def request(i):
+        with server.client():
+            barrier.wait()
+            # each caller sends a different number of observations
+            results[i] = server.act([{'id': i * 100 + j} for j in range(i % 3 + 1)])
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i in range(num_threads):
+        assert results[i][:, 0].tolist() == [float(i * 100 + j) for j in range(i % 3 + 1)]
+    # the requests were coalesced, up to the maximum batch size
+    num_observations = sum(i % 3 + 1 for i in range(num_threads))
+    assert sum(server.policy.batch_sizes) == num_observations
+    assert len(server.policy.batch_sizes) < num_threads
+
+
+def test_single_client_does_not_wait_for_the_timeout():
+    server = BatchedInferenceServer(RecordingPolicy(), preprocess_obs, 'cpu', timeout=10.)
+    try:
+        with server.client():
+            start = time.perf_counter()
+            for i in range(3):
+                assert server.act({'id': i}).tolist() == [[float(i)] * 3]
+            assert time.perf_counter() - start < 5.
+    finally:
+        server.close()
+
+
+def test_propagates_errors_to_callers(server):
+    with pytest.raises(KeyError):
+        server.act({'other': 0})
+    # the server keeps serving after a failed batch
+    assert server.act({'id': 3}).tolist() == [[3., 3., 3.]]
+
+
+def test_act_after_close_raises(server):
+    server.close()
+    with pytest.raises(RuntimeError):
+        server.act({'id': 0})
+    # closing twice is harmless
+    server.close()
+
+
+def test_close_servers():
+    servers = {i: BatchedInferenceServer(RecordingPolicy(), preprocess_obs, 'cpu') for i in range(2)}
+    threads = [server.thread for server in servers.values()]
+    close_servers(servers)
+    assert servers == {}
+    assert not any(thread.is_alive() for thread in threads)
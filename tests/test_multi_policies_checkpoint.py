@@ -0,0 +1,78 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('torch_geometric')
+pytest.importorskip('gym')
+
+from virne.solver.learning.a3c_gcn.solver import A3CGcnMultiPoliciesSolver
+
+
+TASK_IDS = [5, 10]
+
+
+def make_model(seed):
+    torch.manual_seed(seed)
+    policy = torch.nn.Sequential(torch.nn.Linear(3, 4), torch.nn.Linear(4, 2))
+    optimizer = torch.optim.Adam(policy.parameters())
+    policy(torch.ones(1, 3)).sum().backward()
+    optimizer.step()
+    return policy, optimizer
+
+
+def make_models():
+    models = {'meta_policy': make_model(0)}
+    for task_id in TASK_IDS:
+        models[task_id] = make_model(task_id)
+    return models
+
+
+def make_legacy_checkpoint(models):
+    meta_policy, meta_optimizer = models['meta_policy']
+    checkpoint = {'meta_policy': {'policy': meta_policy.state_dict(), 'optimizer': meta_optimizer.state_dict()}, 'task_policies': {}}
+    for task_id in TASK_IDS:
+        policy, optimizer = models[task_id]
+        # legacy checkpoints may have been re-keyed with string task ids
+        checkpoint['task_policies'][str(task_id)] = {'policy': policy.state_dict(), 'optimizer': optimizer.state_dict()}
+    return checkpoint
+
+
+def make_flat_checkpoint(models):
+    # as written by A3CGcnMultiPoliciesSolver.save_model
+    checkpoint = {}
+    for key, (policy, optimizer) in models.items():
+        prefix = key if key == 'meta_policy' else f'task/{key}'
+        for name, tensor in policy.state_dict().items():
+            checkpoint[f'{prefix}/policy/{name}'] = tensor
+        checkpoint[f'{prefix}/optimizer'] = optimizer.state_dict()
+    return checkpoint
+
+
+def assert_state_equal(state, model):
+    policy, optimizer = model
+    assert state['policy'].keys() == policy.state_dict().keys()
+    for name, tensor in policy.state_dict().items():
+        torch.testing.assert_close(state['policy'][name], tensor)
+    # the state must be loadable as is
+    policy.load_state_dict(state['policy'])
+    optimizer.load_state_dict(state['optimizer'])
+
+
+@pytest.mark.parametrize('make_checkpoint', [make_legacy_checkpoint, make_flat_checkpoint])
+def test_split_checkpoint(make_checkpoint):
+    models = make_models()
+    meta_state, task_states = A3CGcnMultiPoliciesSolver._split_checkpoint(make_checkpoint(models))
+    assert_state_equal(meta_state, models['meta_policy'])
+    assert sorted(task_states.keys()) == TASK_IDS
+    for task_id in TASK_IDS:
+        assert_state_equal(task_states[task_id], models[task_id])
+
+
+def test_split_flat_checkpoint_loaded_with_weights_only(tmp_path):
+    models = make_models()
+    checkpoint_path = tmp_path / 'model.pkl'
+    torch.save(make_flat_checkpoint(models), checkpoint_path)
+    checkpoint = torch.load(checkpoint_path, map_location='cpu', mmap=True, weights_only=True)
+    meta_state, task_states = A3CGcnMultiPoliciesSolver._split_checkpoint(checkpoint)
+    assert_state_equal(meta_state, models['meta_policy'])
+    for task_id in TASK_IDS:
+        assert_state_equal(task_states[task_id], models[task_id])
@@ -1,6 +1,8 @@
-from collections import Counter
 import copy
+import weakref
+import contextlib
 import os
+import pickle
 import torch
 import numpy as np
 import torch.nn as nn
@@ -9,14 +11,26 @@ from torch.distributions import Categorical
 from torch_geometric.data import Data, Batch
 
 from virne.solver import registry
-from virne.solver.learning.rl_base.buffer import RolloutBuffer
+from virne.solver.learning.rl_base.buffer import RolloutBuffer, ObservationBatch
+from virne.solver.learning.rl_base.inference_server import BatchedInferenceServer, keep_raw_obs, close_servers
+from virne.solver.learning.rl_base.searcher import SampleSearcher
 from .instance_env import InstanceRLEnv, InstanceRLEnvWithNrmRank, InstanceRLEnvWithNeaRank
 from .net import ActorCritic
 from virne.solver.learning.rl_base import RLSolver, PPOSolver, A2CSolver, InstanceAgent, A3CSolver
-from ..utils import get_pyg_data
+from ..utils import get_pyg_data, get_single_pyg_batch, get_stacked_pyg_batch, get_batched_edge_index, to_device_async, StaticEdgeIndexCache
 from ..obs_handler import POSITIONAL_EMBEDDING_DIM
 
 
+# Fixed-shape observation fields stored as stacked arrays in the rollout buffer
+OBS_ARRAY_FIELDS = {
+    'p_net_x': np.float32,
+    'v_net_x': np.float32,
+    'curr_v_node_id': np.int64,
+    'v_net_size': np.float32,
+    'action_mask': np.float32,
+}
+
+
 @registry.register(
     solver_name='a3c_gcn',
     solver_type='r_learning')
@@ -24,27 +38,73 @@ class A3CGcnSolver(InstanceAgent, PPOSolver):
     def __init__(self, controller, recorder, counter, **kwargs):
         InstanceAgent.__init__(self, InstanceRLEnv)
         PPOSolver.__init__(self, controller, recorder, counter, make_policy, obs_as_tensor, **kwargs)
+        self.buffer = RolloutBuffer(OBS_ARRAY_FIELDS, pin_memory=self.use_cuda)
+        # coalesce the forward passes of the sampled paths of one solve call into batches
+        self.use_inference_server = kwargs.get('use_inference_server', False)
+        self.inference_max_batch_size = kwargs.get('inference_max_batch_size', 32)
+        self.inference_timeout = kwargs.get('inference_timeout', 0.001)
+        self.inference_servers = {}
+
+    def solve(self, instance):
+        return self._solve_with_policy(instance, self.searcher.policy)
+
+    def _solve_with_policy(self, instance, policy):
+        """Solve the instance with the given policy, leaving the shared searcher untouched."""
+        v_net, p_net = instance['v_net'], instance['p_net']
+        instance_env = self.InstanceEnv(p_net, v_net, self.controller, self.recorder, self.counter, **self.basic_config)
+        searcher = copy.copy(self.searcher)
+        searcher.policy = policy
+        # the k sampled paths run in threads whose forward passes the server batches together
+        if self.use_inference_server and isinstance(searcher, SampleSearcher) and searcher.k > 1:
+            searcher.policy = self._get_inference_server(policy)
+            searcher.preprocess_obs_func = keep_raw_obs
+        # inference: no dropout, no batch-norm updates and no autograd bookkeeping
+        was_training = policy.training
+        policy.eval()
+        try:
+            with torch.inference_mode(), self.autocast():
+                return searcher.find_solution(instance_env)
+        finally:
+            policy.train(was_training)
+
+    def _get_inference_server(self, policy):
+        if policy not in self.inference_servers:
+            if not self.inference_servers:
+                # stop the server threads when the solver is garbage collected or at exit
+                weakref.finalize(self, close_servers, self.inference_servers)
+            self.inference_servers[policy] = BatchedInferenceServer(policy, self.preprocess_obs, self.device, 
+                                                                    max_batch_size=self.inference_max_batch_size, 
+                                                                    timeout=self.inference_timeout, use_amp=self.use_amp)
+        return self.inference_servers[policy]
+
+    def close_inference_servers(self):
+        close_servers(self.inference_servers)
+
+    def train(self):
+        # the inference servers only serve evaluation
+        self.close_inference_servers()
+        super().train()
 
 
 @registry.register(
     solver_name='a3c_gcn_nrm_rank',
     solver_type='r_learning')
-class A3CGcnNrmRankSolver(InstanceAgent, PPOSolver):
+class A3CGcnNrmRankSolver(A3CGcnSolver):
     def __init__(self, controller, recorder, counter, **kwargs):
+        A3CGcnSolver.__init__(self, controller, recorder, counter, **kwargs)
         InstanceAgent.__init__(self, InstanceRLEnvWithNrmRank)
-        PPOSolver.__init__(self, controller, recorder, counter, make_policy, obs_as_tensor, **kwargs)
 
 
 @registry.register(
     solver_name='a3c_gcn_nea_rank',
     solver_type='r_learning')
-class A3CGcnNeaRankSolver(InstanceAgent, PPOSolver):
+class A3CGcnNeaRankSolver(A3CGcnSolver):
     def __init__(self, controller, recorder, counter, **kwargs):
+        A3CGcnSolver.__init__(self, controller, recorder, counter, **kwargs)
         InstanceAgent.__init__(self, InstanceRLEnvWithNeaRank)
-        PPOSolver.__init__(self, controller, recorder, counter, make_policy, obs_as_tensor, **kwargs)
 
 
-def make_policy(agent, **kwargs):
+def make_actor_critic(agent):
     num_vn_attrs = agent.v_sim_setting_num_node_resource_attrs
     num_vl_attrs = agent.v_sim_setting_num_link_resource_attrs
     policy = ActorCritic(p_net_num_nodes=agent.p_net_setting_num_nodes, 
@@ -53,6 +113,16 @@ def make_policy(agent, **kwargs):
                         embedding_dim=agent.embedding_dim, 
                         dropout_prob=agent.dropout_prob, 
                         batch_norm=agent.batch_norm).to(agent.device)
+    if agent.use_compile:
+        # compile in place: masking and sampling stay eager, and the state dict keys are unchanged
+        compile_mode = 'reduce-overhead' if agent.device.type == 'cuda' else 'default'
+        policy.actor.compile(mode=compile_mode, dynamic=True)
+        policy.critic.compile(mode=compile_mode, dynamic=True)
+    return policy
+
+
+def make_policy(agent, **kwargs):
+    policy = make_actor_critic(agent)
     optimizer = torch.optim.Adam([
             {'params': policy.actor.parameters(), 'lr': agent.lr_actor},
             {'params': policy.critic.parameters(), 'lr': agent.lr_critic},
@@ -64,58 +134,80 @@ def make_policy(agent, **kwargs):
 @registry.register(
     solver_name='a3c_gcn_multi_policies',
     solver_type='r_learning')
-class A3CGcnMultiPoliciesSolver(InstanceAgent, PPOSolver):
+class A3CGcnMultiPoliciesSolver(A3CGcnSolver):
     def __init__(self, controller, recorder, counter, **kwargs):
-        InstanceAgent.__init__(self, InstanceRLEnv)
-        PPOSolver.__init__(self, controller, recorder, counter, make_policy, obs_as_tensor, **kwargs)
+        A3CGcnSolver.__init__(self, controller, recorder, counter, **kwargs)
         # self.maskable_policy = False
-        self.meta_policy = copy.deepcopy(self.policy)
-        self.meta_optimizer = torch.optim.Adam(self.meta_policy.parameters(), lr=self.lr)
+        self.meta_policy = self._instantiate_policy(self.policy)
+        self.meta_optimizer = self._make_optimizer(self.meta_policy.parameters())
         self.task_policies = {}
         self.task_optimizers = {}
         self.target_steps = 1024
         self.infer_with_single_task_policy_id = kwargs.get('infer_with_single_task_policy_id', 0)
+        # run the updates of the tasks concurrently, each on its own CUDA stream
+        self.enable_parallel_tasks = kwargs.get('enable_parallel_tasks', False) and self.use_cuda
+        self.task_streams = {}
         if self.infer_with_single_task_policy_id != 0:
             print(f'Infer with single task policy id: {self.infer_with_single_task_policy_id}') if self.verbose >= 0 else None
 
     def solve(self, instance):
-        v_net_size = instance['v_net'].num_nodes
+        return self._solve_with_policy(instance, self._select_task_policy(instance))
+
+    def _select_task_policy(self, instance):
         if self.infer_with_single_task_policy_id != 0:
-            self.searcher.policy = self.task_policies[self.infer_with_single_task_policy_id]
-            return super().solve(instance)
-        if v_net_size not in self.task_policies:
-            self.searcher.policy = self.meta_policy
-        else:
-            self.searcher.policy = self.task_policies[v_net_size]
-        return super().solve(instance)
+            return self.task_policies[self.infer_with_single_task_policy_id]
+        v_net_size = instance['v_net'].num_nodes
+        return self.task_policies.get(v_net_size, self.meta_policy)
 
     def save_model(self, checkpoint_fname):
         checkpoint_fname = os.path.join(self.model_dir, checkpoint_fname)
-        model_list = [(task_id, self.task_policies[task_id], self.task_optimizers[task_id]) for task_id in self.task_policies.keys()]
-        task_model_dict = {}
-        task_model_dict['meta_policy'] = {'policy': self.meta_policy.state_dict(), 'optimizer': self.meta_optimizer.state_dict()}
-        task_model_dict['task_policies'] = {}
-        for task_id, policy, optimizer in model_list:
-            task_model_dict['task_policies'][task_id] = {'policy': policy.state_dict(), 'optimizer': optimizer.state_dict()}
-        torch.save(task_model_dict, checkpoint_fname)
+        model_list = [(f'task/{int(task_id)}', self.task_policies[task_id], self.task_optimizers[task_id]) for task_id in self.task_policies.keys()]
+        model_list.insert(0, ('meta_policy', self.meta_policy, self.meta_optimizer))
+        # one flat dict of tensors: torch.load can then map it lazily
+        checkpoint = {}
+        for prefix, policy, optimizer in model_list:
+            for name, tensor in policy.state_dict().items():
+                checkpoint[f'{prefix}/policy/{name}'] = tensor
+            checkpoint[f'{prefix}/optimizer'] = optimizer.state_dict()
+        torch.save(checkpoint, checkpoint_fname)
         print(f'Save model to {checkpoint_fname}\n') if self.verbose >= 0 else None
 
     def load_model(self, checkpoint_path):
         print('Attempting to load the pretrained model')
         try:
-            checkpoint = torch.load(checkpoint_path)
-            self.meta_policy.load_state_dict(checkpoint['meta_policy']['policy'])
-            self.meta_optimizer.load_state_dict(checkpoint['meta_policy']['optimizer'])
-            for task_id in checkpoint['task_policies'].keys():
+            try:
+                checkpoint = torch.load(checkpoint_path, map_location='cpu', mmap=True, weights_only=True)
+            except pickle.UnpicklingError:
+                # checkpoints of the former nested format may hold numpy task ids, which weights_only rejects
+                checkpoint = torch.load(checkpoint_path, map_location='cpu', weights_only=False)
+            meta_state, task_states = self._split_checkpoint(checkpoint)
+            self.meta_policy.load_state_dict(meta_state['policy'])
+            self.meta_optimizer.load_state_dict(meta_state['optimizer'])
+            for task_id, task_state in task_states.items():
                 if task_id not in self.task_policies:
-                    self.task_policies[task_id] = copy.deepcopy(self.meta_policy)
-                    self.task_optimizers[task_id] = torch.optim.Adam(self.task_policies[task_id].parameters(), lr=self.lr)
-                    print('New task policy is created for task {}'.format(task_id))
-                self.task_policies[task_id].load_state_dict(checkpoint['task_policies'][task_id]['policy'])
-                self.task_optimizers[task_id].load_state_dict(checkpoint['task_policies'][task_id]['optimizer'])
+                    self._init_task_policy_and_task_optimizer(task_id)
+                self.task_policies[task_id].load_state_dict(task_state['policy'])
+                self.task_optimizers[task_id].load_state_dict(task_state['optimizer'])
             print(f'Loaded pretrained model from {checkpoint_path}') if self.verbose >= 0 else None
-        except Exception as e:
-            print(f'Load failed from {checkpoint_path}\nInitilized with random parameters') if self.verbose >= 0 else None
+        except (OSError, RuntimeError, KeyError, ValueError, pickle.UnpicklingError) as e:
+            print(f'Load failed from {checkpoint_path}: {e!r}\nInitilized with random parameters') if self.verbose >= 0 else None
+
+    @staticmethod
+    def _split_checkpoint(checkpoint):
+        """Return the meta state and the task states of a checkpoint, each as {'policy': ..., 'optimizer': ...}"""
+        if 'task_policies' in checkpoint:
+            return checkpoint['meta_policy'], {int(task_id): state for task_id, state in checkpoint['task_policies'].items()}
+        states = {}
+        for key, value in checkpoint.items():
+            prefix, _, name = key.rpartition('/') if key.endswith('/optimizer') else key.partition('/policy/')
+            state = states.setdefault(prefix, {'policy': {}})
+            if name == 'optimizer':
+                state['optimizer'] = value
+            else:
+                state['policy'][name] = value
+        meta_state = states.pop('meta_policy')
+        task_states = {int(prefix[len('task/'):]): state for prefix, state in states.items()}
+        return meta_state, task_states
 
     def learn_with_instance(self, instance):
         # sub env for sub agent
@@ -131,110 +223,149 @@ class A3CGcnMultiPoliciesSolver(InstanceAgent, PPOSolver):
     def update(self):
         self._fine_tuning_update()
 
+    def _instantiate_policy(self, source_policy=None):
+        # build a fresh policy and copy the weights in, instead of deep-copying the module
+        source_policy = self.meta_policy if source_policy is None else source_policy
+        policy = make_actor_critic(self)
+        policy.load_state_dict(source_policy.state_dict())
+        return policy
+
+    def _make_optimizer(self, params):
+        # on GPU, the fused step updates all the parameters in a single kernel
+        return torch.optim.Adam(params, lr=self.lr, fused=self.use_cuda)
+
     def _init_task_policy_and_task_optimizer(self, task_id):
-        self.task_policies[task_id] = copy.deepcopy(self.meta_policy)
-        self.task_optimizers[task_id] = torch.optim.Adam(self.task_policies[task_id].parameters(), lr=self.lr)
+        self.task_policies[task_id] = self._instantiate_policy()
+        self.task_optimizers[task_id] = self._make_optimizer(self.task_policies[task_id].parameters())
         print(f'New task policy is created for task {task_id}')
 
-    def _stats_task_dist(self, buffer):
-        v_net_size_list = np.array([obs['v_net_size'] for obs in buffer.observations])
-        return Counter(v_net_size_list)
+    def _task_stream_context(self, task_id):
+        if not self.enable_parallel_tasks:
+            return contextlib.nullcontext()
+        if task_id not in self.task_streams:
+            self.task_streams[task_id] = torch.cuda.Stream(device=self.device)
+        task_stream = self.task_streams[task_id]
+        # start after the work already queued on the current stream (e.g., the rollouts)
+        task_stream.wait_stream(torch.cuda.current_stream(self.device))
+        return torch.cuda.stream(task_stream)
 
-    def _split_buffer(self, buffer):
-        # Split buffer
+    def _get_task_ids(self, buffer):
+        # the task of a transition is the size of its virtual network
+        num_observations = len(buffer.observations)
+        if 'v_net_size' in buffer.obs_arrays:
+            return buffer.obs_arrays['v_net_size'][:num_observations].astype(np.int64)
+        return np.fromiter((obs['v_net_size'] for obs in buffer.observations), dtype=np.int64, count=num_observations)
+
+    def _stats_task_dist(self, task_ids):
+        counts = np.bincount(task_ids)
+        return {int(task_id): int(count) for task_id, count in enumerate(counts) if count}
+
+    def _split_buffer(self, buffer, task_ids):
+        # Split buffer: group the transitions by task with one stable sort
         task_buffers = {}
-        v_net_size_list = np.array([obs['v_net_size'] for obs in buffer.observations])
-        tasks_list = sorted(list(set(v_net_size_list)))
-        for task_id in tasks_list:
-            task_indices = np.where(v_net_size_list == task_id)[0]
-            task_buffer = RolloutBuffer()
+        order = np.argsort(task_ids, kind='stable')
+        tasks_list, starts = np.unique(task_ids[order], return_index=True)
+        ends = np.r_[starts[1:], len(order)]
+        actions = np.asarray(buffer.actions)
+        logprobs = np.asarray(buffer.logprobs)
+        rewards = np.asarray(buffer.rewards)
+        returns = np.asarray(buffer.returns)
+        for task_id, start, end in zip(tasks_list, starts, ends):
+            task_indices = order[start:end]
+            task_buffer = RolloutBuffer(buffer.obs_array_fields, pin_memory=buffer.pin_memory)
             task_buffer.observations = [buffer.observations[i] for i in task_indices]
-            task_buffer.actions = np.array(buffer.actions)[task_indices].tolist()
-            task_buffer.logprobs = np.array(buffer.logprobs)[task_indices].tolist()
-            task_buffer.rewards = np.array(buffer.rewards)[task_indices].tolist()
-            task_buffer.returns = np.array(buffer.returns)[task_indices].tolist()
+            task_buffer.obs_arrays = {key: array[task_indices] for key, array in buffer.obs_arrays.items()}
+            task_buffer.actions = actions[task_indices].tolist()
+            task_buffer.logprobs = logprobs[task_indices].tolist()
+            task_buffer.rewards = rewards[task_indices].tolist()
+            task_buffer.returns = returns[task_indices].tolist()
             # task_buffer.action_masks = [buffer.action_masks[i] for i in task_indices]
-            task_buffers[task_id] = task_buffer
-        task_buffers = {k: task_buffers[k] for k in sorted(list(task_buffers.keys()))}
+            task_buffers[int(task_id)] = task_buffer
         return task_buffers
 
     def _fine_tuning_update(self):
         meta_buffer = self.buffer
         # Initialize task policies
-        task_dist = self._stats_task_dist(self.buffer)
+        task_ids = self._get_task_ids(self.buffer)
+        task_dist = self._stats_task_dist(task_ids)
         print(f'Task distribution: {task_dist}')
         for task_id in task_dist.keys():
             if task_id not in self.task_policies:
-                self.task_policies[task_id] = copy.deepcopy(self.meta_policy)
-                self.task_optimizers[task_id] = torch.optim.Adam(self.task_policies[task_id].parameters(), lr=self.lr)
+                self._init_task_policy_and_task_optimizer(task_id)
         # Split buffer
-        task_buffers = self._split_buffer(self.buffer)
+        task_buffers = self._split_buffer(self.buffer, task_ids)
         # Inner loop
         for task_id in task_buffers.keys():
             self.policy = self.task_policies[task_id]
             self.optimizer = self.task_optimizers[task_id]
             self.buffer = task_buffers[task_id]
-            super().update()
+            with self._task_stream_context(task_id):
+                super().update()
+        if self.enable_parallel_tasks:
+            current_stream = torch.cuda.current_stream(self.device)
+            for task_id in task_buffers.keys():
+                current_stream.wait_stream(self.task_streams[task_id])
         meta_buffer.clear()
+        self.buffer = meta_buffer
+
+
+# the physical network topology is static: its edges are shipped to the device once
+p_net_edge_index_cache = StaticEdgeIndexCache()
+
+
+def stack_obs_field(obs, key, dtype, pin_memory=False):
+    """Stack one field of a list of observations, reusing the arrays stored by the rollout buffer if any."""
+    if isinstance(obs, ObservationBatch) and key in obs.arrays:
+        # pinned tensors if gathered from a pinned rollout buffer, numpy arrays otherwise
+        return torch.as_tensor(obs.arrays[key]).to(dtype)
+    # stage the field in one (pinned) host buffer instead of a list of per-sample arrays
+    array = torch.empty((len(obs), *np.shape(obs[0][key])), dtype=dtype, pin_memory=pin_memory)
+    array_buf = array.numpy()
+    for i, observation in enumerate(obs):
+        array_buf[i] = observation[key]
+    return array
 
 
 def obs_as_tensor(obs, device):
     # one
     if isinstance(obs, dict):
-        """Preprocess the observation to adapt to batch mode."""
-        tensor_obs_p_net = get_pyg_data(obs['p_net_x'], obs['p_net_edge_index'])
-        tensor_obs_p_net = Batch.from_data_list([tensor_obs_p_net]).to(device)
-        tensor_obs_v_net_x = torch.FloatTensor(np.array([obs['v_net_x']])).to(device)
-        tensor_obs_curr_v_node_id = torch.LongTensor(np.array([obs['curr_v_node_id']])).to(device)
-        tensor_obs_action_mask = torch.FloatTensor(np.array([obs['action_mask']])).to(device)
-        tensor_obs_v_net_size = torch.FloatTensor(np.array([obs['v_net_size']])).to(device)
-        return {'p_net': tensor_obs_p_net, 'v_net_x': tensor_obs_v_net_x, 'curr_v_node_id': tensor_obs_curr_v_node_id, 'action_mask': tensor_obs_action_mask, 'v_net_size': tensor_obs_v_net_size}
+        return _obs_dict_as_tensor(obs, device)
     # batch
     elif isinstance(obs, list):
-        p_net_data_list, v_net_x_list, v_net_size_list, curr_v_node_id_list, action_mask_list = [], [], [], [], []
-        for observation in obs:
-            p_net_data = get_pyg_data(observation['p_net_x'], observation['p_net_edge_index'])
-            p_net_data_list.append(p_net_data)
-            v_net_x_list.append(observation['v_net_x'])
-            v_net_size_list.append(observation['v_net_size'])
-            curr_v_node_id_list.append(observation['curr_v_node_id'])
-            action_mask_list.append(observation['action_mask'])
-        tensor_obs_p_net = Batch.from_data_list(p_net_data_list).to(device)
-        tensor_obs_v_net_x = torch.FloatTensor(np.array(v_net_x_list)).to(device)
-        tensor_obs_v_net_size = torch.FloatTensor(np.array(v_net_size_list)).to(device)
-        tensor_obs_curr_v_node_id = torch.LongTensor(np.array(curr_v_node_id_list)).to(device)
-        tensor_obs_action_mask = torch.FloatTensor(np.array(action_mask_list)).to(device)
-        return {'p_net': tensor_obs_p_net, 'v_net_x': tensor_obs_v_net_x, 'v_net_size': tensor_obs_v_net_size, 'curr_v_node_id': tensor_obs_curr_v_node_id, 'action_mask': tensor_obs_action_mask}
+        return _obs_list_as_tensor(obs, device)
     else:
         raise Exception(f"Unrecognized type of observation {type(obs)}")
 
 
-def obs_as_tensor(obs, device):
-    # one
-    if isinstance(obs, dict):
-        """Preprocess the observation to adapt to batch mode."""
-        tensor_obs_p_net = get_pyg_data(obs['p_net_x'], obs['p_net_edge_index'])
-        tensor_obs_p_net = Batch.from_data_list([tensor_obs_p_net]).to(device)
-        tensor_obs_v_net_x = torch.FloatTensor(np.array([obs['v_net_x']])).to(device)
-        tensor_obs_curr_v_node_id = torch.LongTensor(np.array([obs['curr_v_node_id']])).to(device)
-        tensor_obs_action_mask = torch.FloatTensor(np.array([obs['action_mask']])).to(device)
-        tensor_obs_v_net_size = torch.FloatTensor(np.array([obs['v_net_size']])).to(device)
-        return {'p_net': tensor_obs_p_net, 'v_net_x': tensor_obs_v_net_x, 'curr_v_node_id': tensor_obs_curr_v_node_id, 'action_mask': tensor_obs_action_mask, 'v_net_size': tensor_obs_v_net_size}
-    # batch
-    elif isinstance(obs, list):
-        p_net_data_list, v_net_x_list, v_net_size_list, curr_v_node_id_list, action_mask_list = [], [], [], [], []
-        for observation in obs:
-            p_net_data = get_pyg_data(observation['p_net_x'], observation['p_net_edge_index'])
-            p_net_data_list.append(p_net_data)
-            v_net_x_list.append(observation['v_net_x'])
-            v_net_size_list.append(observation['v_net_size'])
-            curr_v_node_id_list.append(observation['curr_v_node_id'])
-            action_mask_list.append(observation['action_mask'])
-        tensor_obs_p_net = Batch.from_data_list(p_net_data_list).to(device)
-        tensor_obs_v_net_x = torch.FloatTensor(np.array(v_net_x_list)).to(device)
-        tensor_obs_v_net_size = torch.FloatTensor(np.array(v_net_size_list)).to(device)
-        tensor_obs_curr_v_node_id = torch.LongTensor(np.array(curr_v_node_id_list)).to(device)
-        tensor_obs_action_mask = torch.FloatTensor(np.array(action_mask_list)).to(device)
-        return {'p_net': tensor_obs_p_net, 'v_net_x': tensor_obs_v_net_x, 'v_net_size': tensor_obs_v_net_size, 'curr_v_node_id': tensor_obs_curr_v_node_id, 'action_mask': tensor_obs_action_mask}
-    else:
-        raise Exception(f"Unrecognized type of observation {type(obs)}")
\ No newline at end of file
+def _obs_dict_as_tensor(obs, device):
+    """Preprocess the observation to adapt to batch mode."""
+    tensor_obs_p_net_x = torch.as_tensor(obs['p_net_x'], dtype=torch.float32, device=device)
+    p_net_edge_index = p_net_edge_index_cache.get([obs['p_net_edge_index']], tensor_obs_p_net_x.shape[0], device)
+    tensor_obs_p_net = get_single_pyg_batch(tensor_obs_p_net_x, p_net_edge_index, device)
+    tensor_obs_v_net_x = torch.as_tensor(obs['v_net_x'], dtype=torch.float32, device=device).unsqueeze(0)
+    tensor_obs_curr_v_node_id = torch.as_tensor(obs['curr_v_node_id'], dtype=torch.long, device=device).unsqueeze(0)
+    tensor_obs_action_mask = torch.as_tensor(obs['action_mask'], dtype=torch.float32, device=device).unsqueeze(0)
+    tensor_obs_v_net_size = torch.as_tensor(obs['v_net_size'], dtype=torch.float32, device=device).unsqueeze(0)
+    return {'p_net': tensor_obs_p_net, 'v_net_x': tensor_obs_v_net_x, 'curr_v_node_id': tensor_obs_curr_v_node_id, 'action_mask': tensor_obs_action_mask, 'v_net_size': tensor_obs_v_net_size}
+
+
+def _obs_list_as_tensor(obs, device):
+    """Preprocess a list of observations into one batch."""
+    device = torch.device(device)
+    pin_memory = device.type == 'cuda'
+    v_net_x = stack_obs_field(obs, 'v_net_x', torch.float32, pin_memory)
+    action_mask = stack_obs_field(obs, 'action_mask', torch.float32, pin_memory)
+    curr_v_node_id = stack_obs_field(obs, 'curr_v_node_id', torch.long, pin_memory)
+    v_net_size = stack_obs_field(obs, 'v_net_size', torch.float32, pin_memory)
+    # all the observations share the same physical network size
+    p_net_x = stack_obs_field(obs, 'p_net_x', torch.float32, pin_memory)
+    num_p_nodes = p_net_x.shape[1]
+    p_net_edge_index_list = [observation['p_net_edge_index'] for observation in obs]
+    p_net_edge_index = p_net_edge_index_cache.get(p_net_edge_index_list, num_p_nodes, device)
+    if p_net_edge_index is None:
+        # the observations come from several physical networks
+        p_net_edge_index = get_batched_edge_index(p_net_edge_index_list, num_p_nodes).to(device)
+    tensor_obs_p_net_x, tensor_obs_v_net_x, tensor_obs_v_net_size, tensor_obs_curr_v_node_id, tensor_obs_action_mask = \
+        to_device_async([p_net_x, v_net_x, v_net_size, curr_v_node_id, action_mask], device)
+    tensor_obs_p_net = get_stacked_pyg_batch(tensor_obs_p_net_x, p_net_edge_index)
+    return {'p_net': tensor_obs_p_net, 'v_net_x': tensor_obs_v_net_x, 'v_net_size': tensor_obs_v_net_size, 'curr_v_node_id': tensor_obs_curr_v_node_id, 'action_mask': tensor_obs_action_mask}
@@ -7,7 +7,8 @@ from .safe_rl_solver import SafeRLSolver, AdaptiveStateWiseSafePPOSolver, FixedP
 from .online_rl_environment import RLBaseEnv, OnlineRLEnvBase, PlaceStepRLEnv, JointPRStepRLEnv, SolutionStepRLEnv
 from .instance_rl_environment import InstanceRLEnv, SolutionStepInstanceRLEnv, JointPRStepInstanceRLEnv, PlaceStepInstanceRLEnv, NodePairStepInstanceRLEnv, NodeSlotsStepInstanceRLEnv
 
-from .buffer import RolloutBuffer
+from .buffer import RolloutBuffer, ObservationBatch
+from .inference_server import BatchedInferenceServer
 
 
 __all__ = [
@@ -37,4 +38,6 @@ __all__ = [
     'NodePairStepInstanceRLEnv',
     'NodeSlotsStepInstanceRLEnv',
     'RolloutBuffer',
+    'ObservationBatch',
+    'BatchedInferenceServer',
 ]
@@ -1,10 +1,34 @@
 import torch
+import numpy as np
+
+
+class ObservationBatch(list):
+    """
+    A list of observations that also carries their fixed-shape fields as stacked arrays
+    (numpy arrays, or pinned tensors when gathered from a pinned rollout buffer).
+
+    It can be used wherever a list of observations is expected,
+    while a preprocessor can read the stacked arrays instead of looping over the observations.
+    """
+    def __init__(self, observations, arrays):
+        super(ObservationBatch, self).__init__(observations)
+        self.arrays = arrays
 
 
 class RolloutBuffer:
     
-    def __init__(self, ):
+    def __init__(self, obs_array_fields=None, pin_memory=False):
+        """
+        Args:
+            obs_array_fields (dict, optional): Fixed-shape observation fields to additionally store as
+                stacked arrays (structure of arrays), mapping each field name to its dtype. Defaults to None.
+            pin_memory (bool, optional): Whether to keep the observation arrays, and the minibatches gathered
+                from them, in page-locked memory for asynchronous host-to-device copies. Defaults to False.
+        """
         self.curr_idx = 0
+        self.obs_array_fields = dict(obs_array_fields) if obs_array_fields is not None else {}
+        self.pin_memory = pin_memory
+        self.obs_arrays = {}
         self.basic_items = ['observations', 'actions', 'rewards', 'dones', 'next_observations', 'logprobs', 'values']
         self.calc_items = ['advantages', 'returns']
         self.extend_items = ['hidden_states', 'cell_states', 'action_mask', 'entropies']
@@ -15,6 +39,7 @@ class RolloutBuffer:
         return self.basic_items + self.calc_items + self.extend_items
 
     def reset(self):
+        # the observation arrays are kept allocated and overwritten by the next rollouts
         self.curr_idx = 0
         for item in self.all_items:
             setattr(self, item, [])
@@ -36,10 +61,56 @@ class RolloutBuffer:
         self.logprobs.append(logprob)
         self.values.append(value)
         self.next_observations.append(next_obs)
+        self.store_obs_arrays([obs])
         self.curr_idx += 1
+
+    def store_obs_arrays(self, observations):
+        """Write the fixed-shape fields of the observations just appended into the observation arrays."""
+        if not self.obs_array_fields or len(observations) == 0:
+            return
+        end = len(self.observations)
+        start = end - len(observations)
+        for key, dtype in self.obs_array_fields.items():
+            shape = np.shape(observations[0][key])
+            array = self.obs_arrays.get(key)
+            if array is None or array.shape[1:] != shape:
+                assert start == 0, f'The shape of observation field {key} changed within the buffer'
+                array = self._empty_array((end, *shape), dtype)
+            elif array.shape[0] < end:
+                # grow geometrically to keep the amortized cost of appending constant
+                new_array = self._empty_array((max(end, 2 * array.shape[0]), *shape), dtype)
+                new_array[:start] = array[:start]
+                array = new_array
+            for i, obs in enumerate(observations):
+                array[start + i] = obs[key]
+            self.obs_arrays[key] = array
+
+    def _empty_array(self, shape, dtype):
+        if not self.pin_memory:
+            return np.empty(shape, dtype=dtype)
+        # a numpy view of a pinned tensor: the observations are written straight into page-locked memory
+        torch_dtype = torch.from_numpy(np.empty(0, dtype=dtype)).dtype
+        return torch.empty(shape, dtype=torch_dtype, pin_memory=True).numpy()
+
+    def get_observations(self, indices):
+        """Gather the observations at the indices, along with their stacked fixed-shape fields if stored."""
+        observations = [self.observations[i] for i in indices]
+        if not self.obs_arrays:
+            return observations
+        if not self.pin_memory:
+            indices = np.asarray(indices)
+            return ObservationBatch(observations, {key: array[indices] for key, array in self.obs_arrays.items()})
+        # gather into fresh pinned tensors: the host allocator keeps them alive until their pending copies are done
+        indices = torch.as_tensor(indices, dtype=torch.long)
+        arrays = {}
+        for key, array in self.obs_arrays.items():
+            source = torch.from_numpy(array)
+            arrays[key] = torch.empty((len(indices), *source.shape[1:]), dtype=source.dtype, pin_memory=True)
+            torch.index_select(source, 0, indices, out=arrays[key])
+        return ObservationBatch(observations, arrays)
     
     def get_subbuffer(self, indices):
-        sub_buffer = RolloutBuffer()
+        sub_buffer = RolloutBuffer(self.obs_array_fields, pin_memory=self.pin_memory)
         for item in self.all_items:
             item_list = getattr(self, item)
             sub_item_list = getattr(sub_buffer, item)
@@ -47,6 +118,9 @@ class RolloutBuffer:
                 continue
             for idx in indices:
                 sub_item_list.append(item_list[idx])
+        if self.obs_arrays and len(indices) > 0:
+            indices = np.asarray(indices)
+            sub_buffer.obs_arrays = {key: array[indices] for key, array in self.obs_arrays.items()}
         return sub_buffer
 
     def extend(self, item):
@@ -87,6 +161,7 @@ class RolloutBuffer:
             main_item_list = getattr(self, item)
             sub_item_list = getattr(buffer, item)
             main_item_list += sub_item_list
+        self.store_obs_arrays(buffer.observations)
         # self.observations += copy.deepcopy(buffer.observation)
         # self.actions += copy.deepcopy(buffer.actions)
         # self.rewards += copy.deepcopy(buffer.rewards)
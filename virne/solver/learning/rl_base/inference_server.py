@@ -0,0 +1,125 @@
+import time
+import queue
+import threading
+import torch
+import contextlib
+from concurrent.futures import Future
+
+
+def keep_raw_obs(obs, device=None):
+    """Preprocessor of the searchers served by a BatchedInferenceServer: the server preprocesses the observations itself."""
+    return obs
+
+
+def close_servers(servers):
+    """Stop the inference servers of a dict and clear it."""
+    for server in list(servers.values()):
+        server.close()
+    servers.clear()
+
+
+class BatchedInferenceServer:
+    """
+    Serve the action logits of a policy to concurrent callers, coalescing their observations into batches.
+
+    Callers (e.g., the threads sampling the paths of a SampleSearcher) register with `client` and
+    submit raw observations with `act`. A server thread gathers up to `max_batch_size` pending observations,
+    waiting at most `timeout` seconds after the first one, but not at all once every registered client
+    has a request pending. It then preprocesses them as one batch and runs a single forward pass of the policy.
+    It can stand in for the policy of a searcher whose preprocessor is `keep_raw_obs`.
+    Only the server thread runs the policy, so one policy must not be served by several servers.
+    """
+    def __init__(self, policy, preprocess_obs_func, device, max_batch_size=32, timeout=0.001, use_amp=False):
+        """
+        Args:
+            policy: policy providing `act(tensor_obs)`
+            preprocess_obs_func: function converting a list of raw observations into a tensor batch
+            device: device of the forward passes
+            max_batch_size (int, optional): maximum number of observations per forward pass. Defaults to 32.
+            timeout (float, optional): maximum time (in seconds) to wait for more requests. Defaults to 0.001.
+            use_amp (bool, optional): whether to run the forward passes in bf16 autocast on GPU. Defaults to False.
+        """
+        self.policy = policy
+        self.preprocess_obs_func = preprocess_obs_func
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.timeout = timeout
+        self.use_amp = use_amp
+        self.num_clients = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+
+    def act(self, obs):
+        """Return the action logits of one observation (dict) or of a list of observations, on the device."""
+        observations = [obs] if isinstance(obs, dict) else list(obs)
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('The inference server is closed')
+            self.requests.put((observations, future))
+        return future.result()
+
+    @contextlib.contextmanager
+    def client(self):
+        """Register the calling thread as a client, which sends at most one request at a time, for the context."""
+        with self.lock:
+            self.num_clients += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self.num_clients -= 1
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.requests.put((None, None))
+        self.thread.join()
+
+    def autocast(self):
+        # autocast is thread-local: the server thread does not inherit the one of its callers
+        if self.use_amp:
+            return torch.autocast('cuda', dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    def _serve(self):
+        while True:
+            request = self.requests.get()
+            if request[1] is None:
+                return
+            batch = [request]
+            num_observations = len(request[0])
+            deadline = time.perf_counter() + self.timeout
+            while num_observations < self.max_batch_size:
+                # only wait while some registered client may still send a request
+                remaining = deadline - time.perf_counter() if len(batch) < self.num_clients else 0.
+                try:
+                    request = self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request[1] is None:
+                    # serve the pending requests before stopping
+                    self.requests.put(request)
+                    break
+                batch.append(request)
+                num_observations += len(request[0])
+            self._infer(batch)
+
+    def _infer(self, batch):
+        try:
+            observations = [observation for observations, future in batch for observation in observations]
+            with torch.inference_mode(), self.autocast():
+                tensor_obs = self.preprocess_obs_func(observations, device=self.device)
+                action_logits = self.policy.act(tensor_obs).float()
+            start = 0
+            for observations, future in batch:
+                future.set_result(action_logits[start:start + len(observations)])
+                start += len(observations)
+        except Exception as e:
+            for observations, future in batch:
+                future.set_exception(e)
@@ -17,7 +17,8 @@ class InstanceAgent(object):
     def solve(self, instance):
         v_net, p_net = instance['v_net'], instance['p_net']
         instance_env = self.InstanceEnv(p_net, v_net, self.controller, self.recorder, self.counter, **self.basic_config)
-        solution = self.searcher.find_solution(instance_env)
+        with self.autocast():
+            solution = self.searcher.find_solution(instance_env)
         return solution
 
     def validate(self, env, checkpoint_path=None):
@@ -1,6 +1,7 @@
 import os
 import csv
 import copy
+import contextlib
 import time
 import tqdm
 import pprint
@@ -10,6 +11,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.multiprocessing as mp
 from torch.multiprocessing import Process, Pool
+from torch.nn.parallel import DistributedDataParallel
 from torch.distributions import Categorical
 from torch.utils.tensorboard import SummaryWriter
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
@@ -21,7 +23,7 @@ from virne.solver.heuristic.node_rank import *
 from .searcher import *
 from .buffer import RolloutBuffer
 from .shared_adam import SharedAdam, sync_gradients
-from ..utils import apply_mask_to_logit, get_observations_sample, RunningMeanStd
+from ..utils import apply_mask_to_logit, sample_action_from_logits, get_observations_sample, RunningMeanStd
 from virne.utils import test_running_time
 
 
@@ -51,6 +53,12 @@ class RLSolver(Solver):
             self.device = torch.device('cpu')
             self.device_name = 'CPU'
             self.use_cuda = False
+        # numerics: TF32 matmuls and bf16 autocast of the forward passes, on GPU only
+        self.allow_tf32 = kwargs.get('allow_tf32', False)
+        self.use_amp = kwargs.get('use_amp', False) and self.use_cuda
+        if self.allow_tf32:
+            torch.backends.cuda.matmul.allow_tf32 = True
+            torch.backends.cudnn.allow_tf32 = True
         self.num_workers = kwargs.get('num_workers', 1)
         self.distributed_training = False if self.num_workers == 1 else kwargs.get('distributed_training', False)
         # rl
@@ -70,9 +78,11 @@ class RLSolver(Solver):
         self.embedding_dim = kwargs.get('embedding_dim', 64)
         self.dropout_prob = kwargs.get('dropout_prob', 0.5)
         self.batch_norm = kwargs.get('batch_norm', False)
+        self.use_compile = kwargs.get('use_compile', False)
         # train
         self.batch_size = kwargs.get('batch_size', 128)
         self.use_negative_sample = kwargs.get('use_negative_sample', False)
+        self.grad_accumulation_steps = kwargs.get('grad_accumulation_steps', 1)
         self.target_steps = kwargs.get('target_steps', 128)
         self.eval_interval = kwargs.get('eval_interval', 5)
         # eval;
@@ -169,9 +179,15 @@ class RLSolver(Solver):
             info_str = ' & '.join([f'{v:+3.4f}' for k, v in info.items() if sum([s in k for s in ['loss', 'prob', 'return', 'penalty', 'value']])])
             print(f'Update time: {update_time:06d} | ' + info_str)
 
+    def autocast(self):
+        """Return the autocast context of the forward passes (bf16 if AMP is enabled)."""
+        if self.use_amp:
+            return torch.autocast('cuda', dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
     def get_action_prob_dist(self, observation):
-        with torch.no_grad():
-            action_logits = self.policy.act(observation)
+        with torch.no_grad(), self.autocast():
+            action_logits = self.policy.act(observation).float()
         if 'action_mask' in observation and self.mask_actions:
             mask = observation['action_mask']
             candidate_action_logits = apply_mask_to_logit(action_logits, mask) 
@@ -181,33 +197,12 @@ class RLSolver(Solver):
         return action_prob_dist, candidate_action_logits
 
     def select_action(self, observation, sample=True):
-        with torch.no_grad():
-            action_logits = self.policy.act(observation)
-        if 'action_mask' in observation and self.mask_actions:
-            mask = observation['action_mask']
-            candidate_action_logits = apply_mask_to_logit(action_logits, mask) 
-        else:
-            candidate_action_logits = action_logits
-        # if self.mask_actions and self.maskable_policy:
-        #     candidate_action_probs = F.softmax(candidate_action_logits / self.softmax_temp, dim=-1)
-        #     candidate_action_dist = Categorical(probs=candidate_action_probs)
-        # else:
-        #     candidate_action_probs = F.softmax(action_logits / self.softmax_temp, dim=-1)
-        #     candidate_action_dist = Categorical(probs=candidate_action_probs)
-        candidate_action_dist = Categorical(logits=candidate_action_logits / self.softmax_temp)
-        raw_action_dist = Categorical(logits=action_logits / self.softmax_temp)
-
-        if self.mask_actions and self.maskable_policy:
-            action_dist_for_log_prob = candidate_action_dist
-        else:
-            action_dist_for_log_prob = raw_action_dist
-
-        if sample:
-            action = candidate_action_dist.sample()
-        else:
-            action = candidate_action_logits.argmax(-1)
-
-        action_logprob = action_dist_for_log_prob.log_prob(action)
+        with torch.no_grad(), self.autocast():
+            action_logits = self.policy.act(observation).float()
+        mask = observation['action_mask'] if 'action_mask' in observation and self.mask_actions else None
+        # sample and take the log probability with tensor ops, without building Categorical distributions
+        action, action_logprob = sample_action_from_logits(action_logits, mask, sample=sample, softmax_temp=self.softmax_temp, 
+                                                           masked_logprob=self.mask_actions and self.maskable_policy)
         
         if torch.numel(action) == 1:
             action = action.item()
@@ -217,7 +212,9 @@ class RLSolver(Solver):
         return action, action_logprob.cpu().detach().numpy()
 
     def evaluate_actions(self, old_observations, old_actions, return_others=False):
-        actions_logits = self.policy.act(old_observations)
+        # the losses are computed in fp32 from the (possibly bf16) network outputs
+        with self.autocast():
+            actions_logits = self.policy.act(old_observations).float()
         actions_probs = F.softmax(actions_logits / self.softmax_temp, dim=-1)
         if 'action_mask' in old_observations:
             masks = old_observations['action_mask']
@@ -235,7 +232,8 @@ class RLSolver(Solver):
         action_logprobs = policy_dist.log_prob(old_actions)
         dist_entropy = policy_dist.entropy()
 
-        values = self.policy.evaluate(old_observations).squeeze(-1) if hasattr(self.policy, 'evaluate') else None
+        with self.autocast():
+            values = self.policy.evaluate(old_observations).squeeze(-1).float() if hasattr(self.policy, 'evaluate') else None
 
         if return_others:
             other = {}
@@ -259,7 +257,7 @@ class RLSolver(Solver):
         """
         Estimate the value of an observation
         """
-        with torch.no_grad():
+        with torch.no_grad(), self.autocast():
             estimated_value = self.policy.evaluate(observation).squeeze(-1).detach().cpu().item()
         return estimated_value
 
@@ -352,11 +350,23 @@ class RLSolver(Solver):
                                     mask_actions=self.mask_actions, 
                                     maskable_policy=self.maskable_policy)
 
-    def update_grad(self, loss):
+    def update_grad(self, loss, zero_grad=True, step=True):
+        """
+        Backpropagate the loss and update the parameters.
+
+        Args:
+            loss: loss to backpropagate
+            zero_grad: whether to clear the accumulated gradients first
+            step: whether to step the optimizer; if not, the gradients are only accumulated
+        """
+        if not step:
+            if zero_grad: self.optimizer.zero_grad()
+            loss.backward()
+            return None
         # update parameters
         if self.distributed_training:
             with self.lock:
-                self.optimizer.zero_grad()
+                if zero_grad: self.optimizer.zero_grad()
                 self.shared_optimizer.zero_grad()
                 loss.backward()
                 grad_clipped = torch.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm) if self.clip_grad else None
@@ -364,12 +374,18 @@ class RLSolver(Solver):
                 self.optimizer.step()
                 self.shared_optimizer.step()
         else:
-            self.optimizer.zero_grad()
+            if zero_grad: self.optimizer.zero_grad()
             loss.backward()
             grad_clipped = torch.nn.utils.clip_grad_norm_(self.policy.parameters(), self.max_grad_norm) if self.clip_grad else None
             self.optimizer.step()
         return grad_clipped
 
+    def grad_sync_context(self, sync=True):
+        """Skip the gradient all-reduce of a DistributedDataParallel policy for the non-final accumulation steps."""
+        if not sync and isinstance(self.policy, DistributedDataParallel):
+            return self.policy.no_sync()
+        return contextlib.nullcontext()
+
     def sync_parameters(self):
         assert self.distributed_training, 'distributed_training should be True'
         with self.lock:
@@ -517,34 +533,42 @@ class PPOSolver(RLSolver):
             batch_returns = (batch_returns - batch_returns.mean()) / (batch_returns.std() + 1e-9)
         sample_times = 1 + int(self.buffer.size() * self.repeat_times / self.batch_size)
         for i in range(sample_times):
+            # accumulate the gradients of grad_accumulation_steps minibatches per optimizer step
+            window_start = i - i % self.grad_accumulation_steps
+            # the last window may be cut short by the number of sample times
+            window_size = min(self.grad_accumulation_steps, sample_times - window_start)
+            first_accumulation_step = i == window_start
+            last_accumulation_step = i == window_start + window_size - 1
             sample_indices = torch.randint(0, self.buffer.size(), size=(self.batch_size,)).long()
             # observations  = get_observations_sample(batch_observations, sample_indices, self.device)
-            sample_obersevations = [self.buffer.observations[i] for i in sample_indices]
+            sample_obersevations = self.buffer.get_observations(sample_indices)
             observations = self.preprocess_obs(sample_obersevations, self.device)
             actions = batch_actions[sample_indices].to(self.device)
             returns = batch_returns[sample_indices].to(self.device)
             old_action_logprobs = batch_old_action_logprobs[sample_indices].to(self.device)
-            # evaluate actions and observations
-            values, action_logprobs, dist_entropy, other = self.evaluate_actions(observations, actions, return_others=True)
-            
-            # calculate advantage
-            advantages = returns - values.detach()
-            if self.norm_advantage and values.numel() != 0:
-                advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-9)
-  
-            ratio = torch.exp(action_logprobs - old_action_logprobs)
-            surr1 = ratio * advantages
-            surr2 = torch.clamp(ratio, 1. - self.eps_clip, 1. + self.eps_clip) * advantages
-            actor_loss = - torch.min(surr1, surr2).mean()
-            critic_loss = self.criterion_critic(returns, values)
-            entropy_loss = dist_entropy.mean()
-
-            mask_loss = other.get('mask_actions_probs', 0)
-            prediction_loss = other.get('prediction_loss', 0)
-
-            loss = actor_loss + self.coef_critic_loss * critic_loss - self.coef_entropy_loss * entropy_loss + self.coef_mask_loss * mask_loss + prediction_loss
-            # update parameters
-            grad_clipped = self.update_grad(loss)
+            # the forward pass must also run under no_sync, otherwise DDP still prepares the all-reduce
+            with self.grad_sync_context(sync=last_accumulation_step):
+                # evaluate actions and observations
+                values, action_logprobs, dist_entropy, other = self.evaluate_actions(observations, actions, return_others=True)
+                
+                # calculate advantage
+                advantages = returns - values.detach()
+                if self.norm_advantage and values.numel() != 0:
+                    advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-9)
+      
+                ratio = torch.exp(action_logprobs - old_action_logprobs)
+                surr1 = ratio * advantages
+                surr2 = torch.clamp(ratio, 1. - self.eps_clip, 1. + self.eps_clip) * advantages
+                actor_loss = - torch.min(surr1, surr2).mean()
+                critic_loss = self.criterion_critic(returns, values)
+                entropy_loss = dist_entropy.mean()
+
+                mask_loss = other.get('mask_actions_probs', 0)
+                prediction_loss = other.get('prediction_loss', 0)
+
+                loss = actor_loss + self.coef_critic_loss * critic_loss - self.coef_entropy_loss * entropy_loss + self.coef_mask_loss * mask_loss + prediction_loss
+                # update parameters
+                grad_clipped = self.update_grad(loss / window_size, zero_grad=first_accumulation_step, step=last_accumulation_step)
         
             if self.open_tb and self.update_time % self.log_interval == 0:
                 info = {
@@ -559,8 +583,9 @@ class PPOSolver(RLSolver):
                     'value/return': returns.mean().cpu().numpy(),
                     'value/advantage': advantages.detach().mean().cpu().numpy(),
                     'value/reward': batch_rewards.mean().cpu().numpy(),
-                    'grad/grad_clipped': grad_clipped.detach().cpu().numpy()
                 }
+                if grad_clipped is not None:
+                    info['grad/grad_clipped'] = grad_clipped.detach().cpu().numpy()
                 only_tb = not (i == sample_times-1)
                 self.log(info, self.update_time, only_tb=only_tb)
 
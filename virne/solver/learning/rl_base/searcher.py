@@ -12,7 +12,8 @@ import torch.multiprocessing as mp
 from torch.distributions import Categorical
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
-from ..utils import apply_mask_to_logit
+from ..utils import apply_mask_to_logit, sample_action_from_logits
+from .inference_server import BatchedInferenceServer
 
 
 def get_searcher(decode_strategy, policy, preprocess_obs_func, k, device, mask_actions, maskable_policy, make_policy_func):
@@ -50,24 +51,8 @@ def select_action(
     with torch.no_grad():
         action_logits = policy.act(observation)
 
-    if mask is not None and mask_actions:
-        candidate_action_logits = apply_mask_to_logit(action_logits, mask) 
-    else:
-        candidate_action_logits = action_logits
-
-    if mask_actions and maskable_policy:
-        candidate_action_probs = F.softmax(candidate_action_logits / softmax_temp, dim=-1)
-        candidate_action_dist = Categorical(probs=candidate_action_probs)
-    else:
-        candidate_action_probs = F.softmax(action_logits / softmax_temp, dim=-1)
-        candidate_action_dist = Categorical(probs=candidate_action_dist)
-
-    if sample:
-        action = candidate_action_dist.sample()
-    else:
-        action = candidate_action_logits.argmax(-1)
-
-    action_logprob = candidate_action_dist.log_prob(action)
+    action, action_logprob = sample_action_from_logits(action_logits, mask if mask_actions else None, sample=sample, 
+                                                       softmax_temp=softmax_temp, masked_logprob=mask_actions and maskable_policy)
 
     if torch.numel(action) == 1:
         action = action.item()
@@ -178,25 +163,11 @@ class Searcher:
         with torch.no_grad():
             action_logits = self.policy.act(observation)
 
-        if 'action_mask' in observation and self.mask_actions:
-            mask = observation['action_mask']
-            candidate_action_logits = apply_mask_to_logit(action_logits, mask) 
-        else:
-            candidate_action_logits = action_logits
-
-        if self.mask_actions and self.maskable_policy:
-            candidate_action_probs = F.softmax(candidate_action_logits / self.softmax_temp, dim=-1)
-            candidate_action_dist = Categorical(probs=candidate_action_probs)
-        else:
-            candidate_action_probs = F.softmax(action_logits / self.softmax_temp, dim=-1)
-            candidate_action_dist = Categorical(probs=candidate_action_dist)
-
-        if sample:
-            action = candidate_action_dist.sample()
-        else:
-            action = candidate_action_logits.argmax(-1)
-
-        action_logprob = candidate_action_dist.log_prob(action)
+        mask = observation['action_mask'] if 'action_mask' in observation and self.mask_actions else None
+        # as in RLSolver.select_action: the actions are selected among the candidates,
+        # and a non-maskable policy scores them with its raw logits
+        action, action_logprob = sample_action_from_logits(action_logits, mask, sample=sample, softmax_temp=self.softmax_temp, 
+                                                           masked_logprob=self.mask_actions and self.maskable_policy)
 
         if torch.numel(action) == 1:
             action = action.item()
@@ -292,6 +263,9 @@ class SampleSearcher(Searcher):
             return sample_search_solution(self.policy, instance_env, self.preprocess_obs_func, self.device, 
                                        softmax_temp=self.softmax_temp, mask_actions=self.mask_actions, maskable_policy=self.maskable_policy)
         instance_env_list = [copy.deepcopy(instance_env) for i in range(self.k)]
+        if isinstance(self.policy, BatchedInferenceServer):
+            solutions = self.find_solutions_with_inference_server(instance_env_list)
+            return self.select_best_solution(solutions)
         num_processes = min(multiprocessing.cpu_count(), self.k)
         mp_pool = mp.Pool(processes=num_processes, maxtasksperchild=num_processes * 100)
         args_list = [(self.policy, instance_env_list[i], self.preprocess_obs_func, self.make_policy_func, self.device, False, \
@@ -305,7 +279,21 @@ class SampleSearcher(Searcher):
         #     solution = search_one_solution(self.policy_list[0], instance_env_list[i], self.preprocess_obs_func, self.device, sample=False, 
         #                                    softmax_temp=self.softmax_temp, mask_actions=self.mask_actions, maskable_policy=self.maskable_policy)
         #     solutions.append(solution)
+        return self.select_best_solution(solutions)
+
+    def find_solutions_with_inference_server(self, instance_env_list):
+        """Sample one solution per environment in threads, whose forward passes the inference server batches together."""
+        server = self.policy
+
+        def search(instance_env):
+            with server.client():
+                return sample_search_solution(server, instance_env, self.preprocess_obs_func, self.device, 
+                                              softmax_temp=self.softmax_temp, mask_actions=self.mask_actions, maskable_policy=self.maskable_policy)
+
+        with ThreadPoolExecutor(max_workers=len(instance_env_list)) as executor:
+            return list(executor.map(search, instance_env_list))
 
+    def select_best_solution(self, solutions):
         score_list = [solution.v_net_r2c_ratio if solution.result else 0. for solution in solutions]
         best_index = score_list.index(max(score_list))
         return solutions[best_index]
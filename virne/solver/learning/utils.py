@@ -1,6 +1,10 @@
+import zlib
+import threading
 import torch
+import torch.nn.functional as F
 import numpy as np
 import networkx as nx
+from collections import OrderedDict
 from torch_geometric.data import Data, Batch
 from torch_geometric.utils import sort_edge_index
 from sklearn.preprocessing import StandardScaler, Normalizer
@@ -35,6 +39,141 @@ def get_pyg_data(x, edge_index, edge_attr=None, sort_index=False):
     data = Data(x=x, edge_index=edge_index, edge_attr=edge_attr)
     return data
 
+def get_single_pyg_batch(x, edge_index, device):
+    """
+    Convert the node and edge information of one graph into a Pytorch Geometric batch of size one.
+
+    The `batch` and `ptr` vectors are built directly, skipping the collation of `Batch.from_data_list`.
+
+    Args:
+        x (ndarray): Node features with shape (num_nodes, num_node_features).
+        edge_index (ndarray): Edge connectivity with shape (2, num_edges).
+        device (torch.device): Device of the returned batch.
+
+    Returns:
+        PyTorch Geometric Batch object: Batch object containing the single graph.
+    """
+    x = torch.as_tensor(x, dtype=torch.float32, device=device)
+    edge_index = torch.as_tensor(edge_index, dtype=torch.long, device=device)
+    batch = torch.zeros(x.size(0), dtype=torch.long, device=device)
+    ptr = torch.tensor([0, x.size(0)], dtype=torch.long, device=device)
+    return Batch(x=x, edge_index=edge_index, batch=batch, ptr=ptr)
+
+def get_stacked_pyg_batch(x, edge_index):
+    """
+    Convert a batch of graphs with the same number of nodes into a Pytorch Geometric batch.
+
+    The node features are reshaped and the `batch` and `ptr` vectors are built directly,
+    skipping the per-graph collation of `Batch.from_data_list`.
+
+    Args:
+        x (Tensor): Stacked node features with shape (num_graphs, num_nodes, num_node_features).
+        edge_index (Tensor): Batched edge connectivity on the device of `x`, as returned by `get_batched_edge_index`.
+
+    Returns:
+        PyTorch Geometric Batch object: Batch object containing batched node and edge information.
+    """
+    num_graphs, num_nodes = x.shape[0], x.shape[1]
+    batch = torch.arange(num_graphs, device=x.device).repeat_interleave(num_nodes)
+    ptr = torch.arange(0, (num_graphs + 1) * num_nodes, num_nodes, device=x.device)
+    return Batch(x=x.reshape(num_graphs * num_nodes, -1), edge_index=edge_index, batch=batch, ptr=ptr)
+
+def get_batched_edge_index(edge_index_batch, num_nodes):
+    """
+    Concatenate the edge connectivity of graphs with the same number of nodes, shifted by their node offsets.
+
+    Args:
+        edge_index_batch (list of ndarrays): List of edge connectivity arrays, where each array has shape (2, num_edges_i).
+        num_nodes (int): Number of nodes of each graph.
+
+    Returns:
+        Tensor: Batched edge connectivity with shape (2, sum of num_edges_i).
+    """
+    num_edges = [edge_index.shape[1] for edge_index in edge_index_batch]
+    node_offsets = np.repeat(np.arange(len(edge_index_batch), dtype=np.int64) * num_nodes, num_edges)
+    return torch.from_numpy(np.concatenate(edge_index_batch, axis=1).astype(np.int64) + node_offsets)
+
+
+class StaticEdgeIndexCache:
+    """
+    Cache the device copy of the edge connectivity of a graph whose topology does not change.
+
+    Every call fingerprints the incoming edges (shape and CRC32 of their bytes), so that any other topology,
+    even with the same number of edges, rebuilds the cache. Only the `max_entries` most recently used
+    replicas (one per device, number of graphs and number of nodes) are kept on the device.
+    The cache may be shared by several threads (e.g., training and an inference server), hence the lock,
+    and by several CUDA streams (e.g., those of parallel tasks): every caller's stream waits for the replica
+    to be built and is recorded on it, so that an evicted replica is only freed once its users are done.
+
+    Args:
+        max_entries (int, optional): Number of batched replicas kept on the device. Defaults to 4.
+    """
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self.fingerprint = None
+        self.edge_index = None
+        self.device_edge_index = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, edge_index_batch, num_nodes, device):
+        """
+        Return the batched edge connectivity of graphs sharing one topology.
+
+        Args:
+            edge_index_batch (list of ndarrays): Edge connectivity of each graph with shape (2, num_edges).
+            num_nodes (int): Number of nodes of each graph.
+            device (torch.device): Device of the returned edge connectivity.
+
+        Returns:
+            Tensor: Edge connectivity of the batch on the device, or None if the graphs do not share one topology.
+        """
+        # the observations of a batch often share their edge arrays: fingerprint each array once
+        fingerprints = {}
+        for edge_index in edge_index_batch:
+            if id(edge_index) not in fingerprints:
+                fingerprints[id(edge_index)] = self._fingerprint(edge_index)
+        fingerprint_set = set(fingerprints.values())
+        if len(fingerprint_set) != 1:
+            return None
+        fingerprint = fingerprint_set.pop()
+        key = (str(device), len(edge_index_batch), num_nodes)
+        with self.lock:
+            if fingerprint != self.fingerprint:
+                self.fingerprint = fingerprint
+                self.edge_index = np.array(edge_index_batch[0], dtype=np.int64)
+                self.device_edge_index.clear()
+            if key in self.device_edge_index:
+                self.device_edge_index.move_to_end(key)
+            else:
+                self.device_edge_index[key] = self._replicate(len(edge_index_batch), num_nodes, device)
+                if len(self.device_edge_index) > self.max_entries:
+                    self.device_edge_index.popitem(last=False)
+            replica, ready = self.device_edge_index[key]
+            if ready is not None:
+                current_stream = torch.cuda.current_stream(device)
+                current_stream.wait_event(ready)
+                replica.record_stream(current_stream)
+            return replica
+
+    @staticmethod
+    def _fingerprint(edge_index):
+        edge_index = np.ascontiguousarray(edge_index, dtype=np.int64)
+        return edge_index.shape, zlib.crc32(edge_index)
+
+    @torch.inference_mode(False)
+    def _replicate(self, num_graphs, num_nodes, device):
+        # the cached tensor is shared with training, so it must not be an inference tensor
+        edge_index = torch.as_tensor(self.edge_index, dtype=torch.long, device=device)
+        node_offsets = torch.arange(num_graphs, device=device).repeat_interleave(edge_index.shape[1]) * num_nodes
+        replica = edge_index.repeat(1, num_graphs) + node_offsets
+        # the replica is built on the stream of its first caller: the others wait for it
+        ready = None
+        if replica.is_cuda:
+            ready = torch.cuda.Event()
+            ready.record(torch.cuda.current_stream(device))
+        return replica, ready
+
+
 def get_pyg_batch(x_batch, edge_index_batch, edge_attr_batch=None):
     """
     Convert a batch of node and edge information into Pytorch Geometric format.
@@ -73,6 +212,40 @@ def get_available_device():
         print("Device set to: cpu")
     return device
 
+_copy_streams = {}
+_copy_streams_lock = threading.Lock()
+
+def to_device_async(items, device):
+    """
+    Move a list of tensors or PyG data objects to the device.
+
+    On GPU, the items are pinned and copied with non-blocking transfers on a copy stream dedicated to
+    the current stream, so that the host-to-device copies overlap with the compute queued on the current stream
+    and the copies of concurrent streams (e.g., those of parallel tasks) do not wait for each other.
+
+    Args:
+        items (list): List of tensors or PyG Data/Batch objects on the host.
+        device (torch.device): Target device.
+
+    Returns:
+        list: The items on the target device, in the same order.
+    """
+    device = torch.device(device)
+    if device.type != 'cuda':
+        return [item.to(device) for item in items]
+    current_stream = torch.cuda.current_stream(device)
+    with _copy_streams_lock:
+        if current_stream not in _copy_streams:
+            _copy_streams[current_stream] = torch.cuda.Stream(device=device)
+        copy_stream = _copy_streams[current_stream]
+    with torch.cuda.stream(copy_stream):
+        device_items = [item.pin_memory().to(device, non_blocking=True) for item in items]
+    current_stream.wait_stream(copy_stream)
+    # the copies are allocated on the copy stream but consumed on the current one
+    for item in device_items:
+        item.record_stream(current_stream)
+    return device_items
+
 def normailize_data(data, method='standardize'):
     """
     Normalize node or edge data.
@@ -167,6 +340,31 @@ def apply_mask_to_logit(logit, mask=None):
     masked_logit = torch.where(mask, logit, mask_value_tensor)
     return masked_logit
 
+def sample_action_from_logits(action_logits, mask=None, sample=True, softmax_temp=1.0, masked_logprob=True):
+    """
+    Select actions from logits with plain tensor operations instead of a `Categorical` distribution.
+
+    Args:
+        action_logits (tensor): input logits tensor
+        mask (tensor, optional): mask of the candidate actions. Defaults to None.
+        sample (bool, optional): whether to sample the action or take the most probable one. Defaults to True.
+        softmax_temp (float, optional): temperature of the softmax. Defaults to 1.0.
+        masked_logprob (bool, optional): whether the log probability is taken from the masked or the raw logits. Defaults to True.
+
+    Returns:
+        action (tensor): the selected actions
+        action_logprob (tensor): the log probabilities of the selected actions
+    """
+    candidate_action_logits = apply_mask_to_logit(action_logits, mask) / softmax_temp
+    candidate_action_logprobs = F.log_softmax(candidate_action_logits, dim=-1)
+    if sample:
+        action = torch.multinomial(candidate_action_logprobs.exp().reshape(-1, candidate_action_logits.shape[-1]), 1).reshape(candidate_action_logits.shape[:-1])
+    else:
+        action = candidate_action_logits.argmax(-1)
+    action_logprobs = candidate_action_logprobs if masked_logprob else F.log_softmax(action_logits / softmax_temp, dim=-1)
+    action_logprob = action_logprobs.gather(-1, action.unsqueeze(-1)).squeeze(-1)
+    return action, action_logprob
+
 def apply_mask_to_prob(prob, mask=None):
     """
     Apply a mask to a given logits tensor.